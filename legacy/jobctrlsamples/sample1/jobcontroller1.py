@@ -8,19 +8,18 @@ Task: Definition ow work to be done
   it has finished.
 
 JobController: Running Tasks in a predefined order.
-  The controller has for lists:
-    * Tasks waiting to be started
-    * Tasks to start
-    * Running tasks
-    * Finished tasks
-  The controller has a loop that continues as long as the first three lists has any items.
-  Tasks in the waiting list are moved to the "Tasks to start list" when all the tasks it is
-  waiting for has finsihed.
-  An asyncio-loop starts the tasks in the "Tasks to start list" and they are then moved to
-  to the "Running tasks" list.
-  When a task finishes it uses the callback function in the JobController to report this.
-  When this happens the task is moved from the "Running tasks" list to the "Finished tasks"
-  list.
+  When tasks are added the controller records, for every task, which tasks are waiting
+  for it (its children) and how many tasks it is still waiting for.
+  The controller puts all tasks that are not waiting for anything in a queue that is
+  drained by a fixed number of workers (the concurrency). Tasks with the longest chain of
+  tasks after them are taken from the queue first. When a worker starts a task
+  it is put in the "Running tasks" set.
+  When a task finishes it uses the callback function in the JobController to report this,
+  which puts the task in a queue of finished tasks. The controller handles all tasks in
+  that queue at once. For each of them the task is moved from the "Running tasks" set to
+  the "Finished tasks" list, and each of its children that is no longer waiting for
+  anything is queued.
+  The job is done when all tasks have finished.
 
 Future ideas:
   More sofisticated ways to decide if a task should start (at a certain time etc).
@@ -30,14 +29,17 @@ Future ideas:
 """
 
 import asyncio
-import random
+import itertools
 
 
 class Task:
 
-    def __init__(self, name):
+    __slots__ = ("_name", "_simulate", "_wait_for")
+
+    def __init__(self, name, simulate=0):
         self._name = name
-        self._wait_for = []
+        self._simulate = simulate
+        self._wait_for = set()
 
     @property
     def name(self):
@@ -47,20 +49,16 @@ class Task:
     def wait(self):
         return self._wait_for
 
-    @wait.setter
-    def wait(self, value):
-        self._wait_for = value
-
     def __repr__(self):
         return f"<Task {self._name} at {hex(id(self))}>"
 
     def wait_for(self, task_name):
-        self._wait_for.append(task_name)
+        self._wait_for.add(task_name)
         return self
 
     async def run(self, callback):
-        time_to_sleep = random.randint(1, 5)
-        await asyncio.sleep(5)
+        if self._simulate:
+            await asyncio.sleep(self._simulate)
         callback(self)
 
 
@@ -70,59 +68,107 @@ class JobController:
     Kepp track of tasks to be run.
     """
 
-    def __init__(self):
-        self._waiting_tasks = []
+    def __init__(self, concurrency=4):
+        self._concurrency = concurrency
+        self._tasks = []
+        self._children = {}
+        self._remaining = {}
         self._finished_tasks = []
-        self._running_tasks = []
-        self._start_tasks = []
+        self._running_tasks = set()
 
     def add_tasks(self, tasks):
-        self._waiting_tasks.extend(tasks)
-
-    def start(self):
+        for task in tasks:
+            self._tasks.append(task)
+            self._children.setdefault(task.name, [])
+            self._remaining[task] = len(task.wait)
+            for name in task.wait:
+                self._children.setdefault(name, []).append(task)
+
+    async def start(self):
         print("[JOBCTRL] Job started  :")
-        while len(self._waiting_tasks) + len(self._running_tasks) + len(self._start_tasks) > 0:
-            self._process_tasks()
+        self._loop = asyncio.get_running_loop()
+        if hasattr(asyncio, "eager_task_factory"):
+            self._loop.set_task_factory(asyncio.eager_task_factory)
+        self._bottom_levels = self._compute_bottom_levels(self._topological_order())
+        self._sequence = itertools.count()
+        self._queue = asyncio.PriorityQueue()
+        self._finished_queue = asyncio.Queue()
+        workers = [
+            self._loop.create_task(self._worker())
+            for _ in range(self._concurrency)
+        ]
+        workers.append(self._loop.create_task(self._handle_finished_tasks()))
+        for task in [task for task in self._tasks if self._remaining[task] == 0]:
+            self._start_task(task)
+        await self._queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
         print("[JOBCTRL] Job finsished:")
 
-    def _process_tasks(self):
-        self._move_tasks_from_wait_queue()
-        self._do_start_tasks()
-
-    def _move_tasks_from_wait_queue(self):
-        for task in self._waiting_tasks:
-            if self._can_start(task):
-                self._start_tasks.append(task)
-        self._waiting_tasks = [task for task in self._waiting_tasks if task not in self._start_tasks]
-
-    def _can_start(self, task):
-        task.wait = list(set(task.wait).difference(set([task.name for task in self._finished_tasks])))
-        return len(task.wait) == 0
-
-    def _do_start_tasks(self):
-        collector = []
-        for task in self._start_tasks:
-            collector.append(task)
-        self._start_tasks = []
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        tasks = [new_loop.create_task(self._execute_task(task)) for task in collector]
-        new_loop.run_until_complete(asyncio.wait(tasks))
-        new_loop.close()
+    def _topological_order(self):
+        remaining = dict(self._remaining)
+        order = [task for task in self._tasks if remaining[task] == 0]
+        for task in order:
+            for child in self._children[task.name]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    order.append(child)
+        if len(order) != len(self._tasks):
+            raise ValueError("Tasks are waiting for unknown tasks or for each other.")
+        return order
+
+    def _compute_bottom_levels(self, order):
+        """
+        The bottom level of a task is the number of tasks on the longest path from
+        it to the end of the job (including itself).
+        """
+        bottom_levels = {}
+        for task in reversed(order):
+            bottom_levels[task] = 1 + max(
+                (bottom_levels[child] for child in self._children[task.name]),
+                default=0
+            )
+        return bottom_levels
+
+    def _start_task(self, task):
+        self._queue.put_nowait((-self._bottom_levels[task], next(self._sequence), task))
+
+    async def _worker(self):
+        while True:
+            _, _, task = await self._queue.get()
+            await self._execute_task(task)
+
+    async def _handle_finished_tasks(self):
+        """
+        A started task is not done in the queue until it has been handled here, after
+        its children have been queued.
+        """
+        while True:
+            finished = [await self._finished_queue.get()]
+            while not self._finished_queue.empty():
+                finished.append(self._finished_queue.get_nowait())
+            for task in finished:
+                self.task_finished(task)
+                self._queue.task_done()
 
     async def _execute_task(self, task):
         print(f"[JOBCTRL] Task started : {task}")
-        self._running_tasks.append(task)
-        await task.run(self.task_finished)
+        self._running_tasks.add(task)
+        await task.run(self._finished_queue.put_nowait)
 
     def task_finished(self, task):
         self._finished_tasks.append(task)
-        self._running_tasks.remove(task)
+        self._running_tasks.discard(task)
         print(f"[JOBCTRL] Task finished: {task}")
+        for child in self._children[task.name]:
+            self._remaining[child] -= 1
+            if self._remaining[child] == 0:
+                self._start_task(child)
 
 
 
-def test():
+async def test():
     """
                    +----> Task-2 ---->|
       Task-1 ----->|                  |-----> Task-4  ---->  Task-5 ----->|
@@ -140,8 +186,13 @@ def test():
         Task("Task-5").wait_for("Task-4"),
         Task("Task-6").wait_for("Task-1"),
     ])
-    jc.start()
+    await jc.start()
 
 
 if __name__ == "__main__":
-    test()
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    asyncio.run(test())
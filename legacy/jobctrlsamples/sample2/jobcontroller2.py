@@ -8,19 +8,18 @@ Task: Definition ow work to be done
   it has finished.
 
 JobController: Running Tasks in a predefined order.
-  The controller has for lists:
-    * Tasks waiting to be started
-    * Tasks to start
-    * Running tasks
-    * Finished tasks
-  The controller has a loop that continues as long as the first three lists has any items.
-  Tasks in the waiting list are moved to the "Tasks to start list" when all the tasks it is
-  waiting for has finsihed.
-  An asyncio-loop starts the tasks in the "Tasks to start list" and they are then moved to
-  to the "Running tasks" list.
-  When a task finishes it uses the callback function in the JobController to report this.
-  When this happens the task is moved from the "Running tasks" list to the "Finished tasks"
-  list.
+  When tasks are added the controller records, for every task, which tasks are waiting
+  for it (its children) and how many tasks it is still waiting for.
+  The controller puts all tasks that are not waiting for anything in a queue that is
+  drained by a fixed number of workers (the concurrency). Tasks with the longest chain of
+  tasks after them are taken from the queue first. When a worker starts a task
+  it is put in the "Running tasks" set.
+  When a task finishes it uses the callback function in the JobController to report this,
+  which puts the task in a queue of finished tasks. The controller handles all tasks in
+  that queue at once. For each of them the task is moved from the "Running tasks" set to
+  the "Finished tasks" list, and each of its children that is no longer waiting for anything is queued (or
+  skipped).
+  The job is done when all tasks have finished.
 
 Future ideas:
   More sofisticated ways to decide if a task should start (at a certain time etc).
@@ -31,37 +30,58 @@ Future ideas:
 
 import os
 import asyncio
-import random
-import datetime
+import itertools
+import collections
+import concurrent.futures
+import logging
 import time
-import pandas
-import networkx
-from pyvis.network import Network
-import matplotlib.pyplot as plt
 
 OK = 0
 FAILED = 1
 SKIPPED = 2
+STATUS_DESCRIPTIONS = {
+    0: "OK",
+    1: "Failed",
+    2: "Skipped",
+}
+
+logger = logging.getLogger("JOBCTRL")
 
 
 class Task:
+    __slots__ = (
+        "_work_to_be_done",
+        "_compiled_work",
+        "_result",
+        "_started_at",
+        "_ended_at",
+        "_status",
+        "_name",
+        "_wait_for",
+        "_dependants",
+        "_run_on_skip",
+        "_run_on_fail",
+    )
+
     def __init__(self, name):
         self._work_to_be_done = None
+        self._compiled_work = None
         self._result = None
         self._started_at = None
         self._ended_at = None
         self._status = 0
         self._name = name
-        self._wait_for = []
+        self._wait_for = set()
         self._dependants = []
-        self._run_on_skip = []
-        self._run_on_fail = []
+        self._run_on_skip = set()
+        self._run_on_fail = set()
 
     def __repr__(self):
         return f"<Task {self._name} at {hex(id(self))}>"
 
     def command(self, work):
         self._work_to_be_done = work
+        self._compiled_work = None
         return self
 
     @property
@@ -82,11 +102,7 @@ class Task:
 
     @property
     def status(self):
-        return {
-            0: "OK",
-            1: "Failed",
-            2: "Skipped",
-        }[self._status]
+        return STATUS_DESCRIPTIONS[self._status]
 
     @property
     def name(self):
@@ -96,10 +112,6 @@ class Task:
     def wait(self):
         return self._wait_for
 
-    @wait.setter
-    def wait(self, value):
-        self._wait_for = value
-
     @property
     def result(self):
         return self._result
@@ -113,11 +125,11 @@ class Task:
         return self._run_on_skip
 
     def ignore_fail_for(self, names: list[str]):
-        self._run_on_fail = names
+        self._run_on_fail = set(names)
         return self
 
     def ignore_skip_for(self, names: list[str]):
-        self._run_on_skip = names
+        self._run_on_skip = set(names)
         return self
 
     def report(self):
@@ -137,18 +149,21 @@ class Task:
         self._ended_at = self._started_at
 
     def wait_for(self, task_name):
-        self._wait_for.append(task_name)
+        self._wait_for.add(task_name)
         self._dependants.append(task_name)
         return self
 
-    async def run(self, callback):
+    async def run(self, callback, loop, executor):
         try:
             self._started_at = time.time()
-            # Simulate a failed task
-            time_to_sleep = random.randint(1, 10)
-            await asyncio.sleep(time_to_sleep)
             if self._work_to_be_done:
-                self._result = eval(self._work_to_be_done)
+                if self._compiled_work is None:
+                    self._compiled_work = compile(
+                        self._work_to_be_done, f"<task {self._name}>", "eval"
+                    )
+                self._result = await loop.run_in_executor(
+                    executor, eval, self._compiled_work, {"os": os, "__builtins__": {}}
+                )
             self._ended_at = time.time()
         except Exception as ex:
             self._status = FAILED
@@ -162,23 +177,45 @@ class JobController:
     Kepp track of tasks to be run.
     """
 
-    def __init__(self):
-        self._waiting_tasks = []
+    def __init__(self, concurrency=4):
+        self._concurrency = concurrency
+        self._tasks = []
+        self._children = {}
+        self._remaining = {}
         self._finished_tasks = []
-        self._running_tasks = []
-        self._start_tasks = []
+        self._finished_by_name = {}
+        self._running_tasks = set()
 
     def add_tasks(self, tasks):
-        self._waiting_tasks.extend(tasks)
-
-    def start(self):
-        print(self.format_log("Job started  :"))
-        while (
-            len(self._waiting_tasks) + len(self._running_tasks) + len(self._start_tasks)
-            > 0
-        ):
-            self._process_tasks()
-        print(self.format_log("Job finished :"))
+        for task in tasks:
+            self._tasks.append(task)
+            self._children.setdefault(task.name, [])
+            self._remaining[task] = len(task.wait)
+            for name in task.wait:
+                self._children.setdefault(name, []).append(task)
+
+    async def start(self):
+        logger.info("Job started  :")
+        self._loop = asyncio.get_running_loop()
+        if hasattr(asyncio, "eager_task_factory"):
+            self._loop.set_task_factory(asyncio.eager_task_factory)
+        self._bottom_levels = self._compute_bottom_levels(self._topological_order())
+        self._sequence = itertools.count()
+        self._queue = asyncio.PriorityQueue()
+        self._finished_queue = asyncio.Queue()
+        with concurrent.futures.ThreadPoolExecutor(self._concurrency) as self._executor:
+            workers = [
+                self._loop.create_task(self._worker())
+                for _ in range(self._concurrency)
+            ]
+            workers.append(self._loop.create_task(self._handle_finished_tasks()))
+            for task in [task for task in self._tasks if self._remaining[task] == 0]:
+                self._start_task(task)
+            await self._queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logger.info("Job finished :")
         # self.report()
 
     def report(self):
@@ -188,24 +225,9 @@ class JobController:
             except:
                 print(f"Report for task {task} failed")
 
-    def _process_tasks(self):
-        self._move_tasks_from_wait_queue()
-        self._do_start_tasks()
-
-    def _move_tasks_from_wait_queue(self):
-        for task in self._waiting_tasks:
-            if self._can_start(task):
-                self._start_tasks.append(task)
-        self._waiting_tasks = [
-            task for task in self._waiting_tasks if task not in self._start_tasks
-        ]
-        self._waiting_tasks = [
-            task for task in self._waiting_tasks if task not in self._finished_tasks
-        ]
-
     def _can_start(self, task: Task) -> bool:
         """
-        First all Task's we are waiting for must be finished.
+        Called when all Task's we are waiting for are finished.
 
         If any of the finished Task's is skipped the default behaviour is to skip the task.
         To change this behaviour you can define the tasks that wont be counted when investigating
@@ -216,64 +238,91 @@ class JobController:
         finished, failed tasks, by using the ignore_fail_for([names]) method.
 
         """
-        if self._predecessors_not_finished(task):
-            return False
         if self._predecessors_has_failed_or_skipped(task):
             task.do_skip()
-            self.task_finished(task)
             return False
         return True
 
     def _predecessors_has_failed_or_skipped(self, task):
-        skipped = [
-            t.name
-            for t in self._finished_tasks
-            if t.name in task.dependants and t.skipped and t.name not in task.skips
-        ]
-        failed = [
-            t.name
-            for t in self._finished_tasks
-            if t.name in task.dependants and t.failed and t.name not in task.fails
-        ]
-        return len(skipped) + len(failed) > 0
-
-    def _predecessors_not_finished(self, task):
-        finished = [t.name for t in self._finished_tasks]
-        for w in task.wait:
-            if w not in finished:
+        for name in task.dependants:
+            t = self._finished_by_name.get(name)
+            if t is None:
+                continue
+            if t.skipped and name not in task.skips:
+                return True
+            if t.failed and name not in task.fails:
                 return True
         return False
 
-    def _do_start_tasks(self):
-        collector = []
-        for task in self._start_tasks:
-            collector.append(task)
-        self._start_tasks = []
-        if len(collector) > 0:
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            tasks = [
-                new_loop.create_task(self._execute_task(task)) for task in collector
-            ]
-            new_loop.run_until_complete(asyncio.wait(tasks))
-            new_loop.close()
+    def _topological_order(self):
+        remaining = dict(self._remaining)
+        order = [task for task in self._tasks if remaining[task] == 0]
+        for task in order:
+            for child in self._children[task.name]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    order.append(child)
+        if len(order) != len(self._tasks):
+            raise ValueError("Tasks are waiting for unknown tasks or for each other.")
+        return order
+
+    def _compute_bottom_levels(self, order):
+        """
+        The bottom level of a task is the number of tasks on the longest path from
+        it to the end of the job (including itself).
+        """
+        bottom_levels = {}
+        for task in reversed(order):
+            bottom_levels[task] = 1 + max(
+                (bottom_levels[child] for child in self._children[task.name]),
+                default=0
+            )
+        return bottom_levels
+
+    def _start_task(self, task):
+        self._queue.put_nowait((-self._bottom_levels[task], next(self._sequence), task))
+
+    async def _worker(self):
+        while True:
+            _, _, task = await self._queue.get()
+            await self._execute_task(task)
+
+    async def _handle_finished_tasks(self):
+        """
+        A started task is not done in the queue until it has been handled here, after
+        its children have been queued.
+        """
+        while True:
+            finished = [await self._finished_queue.get()]
+            while not self._finished_queue.empty():
+                finished.append(self._finished_queue.get_nowait())
+            for task in finished:
+                self.task_finished(task)
+                self._queue.task_done()
 
     async def _execute_task(self, task):
-        print(self.format_log(f"Task started : {task}"))
-        self._running_tasks.append(task)
-        await task.run(self.task_finished)
+        logger.info("Task started : %s", task)
+        self._running_tasks.add(task)
+        await task.run(self._finished_queue.put_nowait, self._loop, self._executor)
 
     def task_finished(self, task):
-        self._finished_tasks.append(task)
-        if task in self._running_tasks:
-            self._running_tasks.remove(task)
-        print(self.format_log(f"Task finished: {task} Status: {task.status}"))
-
-    def format_log(self, text):
-        return f"[JOBCTRL] {datetime.datetime.now()} {text}"
-
-
-def test():
+        finished = collections.deque([task])
+        while finished:
+            task = finished.popleft()
+            self._finished_tasks.append(task)
+            self._finished_by_name[task.name] = task
+            self._running_tasks.discard(task)
+            logger.info("Task finished: %s Status: %s", task, task.status)
+            for child in self._children[task.name]:
+                self._remaining[child] -= 1
+                if self._remaining[child] == 0:
+                    if self._can_start(child):
+                        self._start_task(child)
+                    else:
+                        finished.append(child)
+
+
+async def test():
     """
                  +----> Task-2 ---->|
     Task-1 ----->|                  |-----> Task-4  ---->  Task-5 ----->|
@@ -292,6 +341,11 @@ def test():
     Task-5  Stop    1
     Task-6  Stop    1
     """
+    # import pandas
+    # import networkx
+    # from pyvis.network import Network
+    # import matplotlib.pyplot as plt
+    #
     # d = {
     #     'source': ['Start', 'Task-1', 'Task-1', 'Task-1', 'Task-2', 'Task-3', 'Task-4', 'Task-5', 'Task-6'],
     #     'target': ['Task-1', 'Task-2', 'Task-3', 'Task-6', 'Task-4', 'Task-4', 'Task-5', 'Stop', 'Stop'],
@@ -332,8 +386,14 @@ def test():
                 .wait_for("Task-1"),
         ]
     )
-    jc.start()
+    await jc.start()
 
 
 if __name__ == "__main__":
-    test()
+    logging.basicConfig(level=logging.INFO, format="[%(name)s] %(asctime)s %(message)s")
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    asyncio.run(test())
@@ -12,8 +12,10 @@ JobController: Running Tasks in a predefined order.
     * Tasks waiting to be started
     * Finished tasks
 
-  The controller places all tasks in the waiting-list and starts them all.
-  The task itself checks if it ok to run or wait for other tasks to complete.
+  The controller places all tasks in the waiting-list and starts them all. When tasks
+  are added the controller records, for every task, which tasks are waiting for it
+  (its children) and how many tasks it is still waiting for.
+  The task itself waits until the controller signals that it is ready to run.
 
   When a task finishes it uses the callback function in the JobController to report this.
   When this happens the task is moved from the waiting-list to the finished-list.
@@ -35,10 +37,10 @@ import sys
 import os
 import subprocess
 import asyncio
-import random
-from workflowdrawer import WorkflowDrawer
+import graphlib
+import hashlib
+import json
 import time
-import datetime
 
 
 OK = 0
@@ -56,9 +58,18 @@ YELLOW = '"#FDFEB2"'
 RED = '"#F63E3E"'
 BLUE = '"#C0FFFF"'
 LILAC = '"#FFC0FF"'
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".rlci_cache")
 
 
 class Task:
+    __slots__ = (
+        "_name", "_fillcolor", "_description", "_wait_for", "_original_waits",
+        "_started_at", "_ended_at", "_status", "_run_on_fail", "_run_on_skip",
+        "_stdout", "_stderr", "_url", "_cwd", "_return_code", "_input",
+        "_except", "_command", "_result", "_ready", "_cache", "_input_files",
+        "_parents", "_cache_key", "_debug",
+    )
+
     def __init__(self, name, description):
         self._name = name
         self._fillcolor = "white"
@@ -67,8 +78,6 @@ class Task:
         self._original_waits = []
         self._started_at = None
         self._ended_at = None
-        self._start_dt = None
-        self._end_dt = None
         self._status = OK
         self._run_on_fail = []
         self._run_on_skip = []
@@ -81,6 +90,11 @@ class Task:
         self._except = ""
         self._command = ""
         self._result = ""
+        self._ready = asyncio.Event()
+        self._cache = False
+        self._input_files = []
+        self._parents = []
+        self._cache_key = None
 
     @property
     def name(self) -> str:
@@ -205,14 +219,22 @@ class Task:
         self._input = input
         return self
 
+    def cache(self, input_files: List[str] = ()) -> Task:
+        """Replay the result of an earlier successful run if nothing has changed.
+
+        The result is looked up by command, cwd, the content of the given input
+        files (relative to cwd) and the cache keys of the tasks waited for.
+        """
+        self._cache = True
+        self._input_files = list(input_files)
+        return self
+
     def skip(self) -> Task:
         """Skip this task from execution."""
         self._status = SKIPPED
         self._fillcolor = YELLOW
         self._started_at = time.time()
-        self._start_dt = f"{datetime.datetime.now()}"
         self._ended_at = self._started_at
-        self._end_dt = f"{datetime.datetime.now()}"
         return self
 
     async def run(self, callback, drawer):
@@ -220,31 +242,27 @@ class Task:
             print(f"[JOBCTRL] Task skipped : {self}")
             self._fillcolor = YELLOW
             self._ended_at = time.time()
-            self._end_dt = f"{datetime.datetime.now()}"
-            drawer.draw()
+            drawer.request_draw()
             callback(self)
         else:
-            while self._wait_for:
-                await asyncio.sleep(0.1)
+            if self._wait_for:
+                await self._ready.wait()
             self._started_at = time.time()
-            self._start_dt = f"{datetime.datetime.now()}"
             if self.stopped:
                 self._fillcolor = LILAC
                 self._ended_at = time.time()
-                self._end_dt = f"{datetime.datetime.now()}"
-                drawer.draw()
+                drawer.request_draw()
                 callback(self)
             elif self.skipped:
                 print(f"[JOBCTRL] Task skipped : {self}")
                 self._fillcolor = YELLOW
                 self._ended_at = time.time()
-                self._end_dt = f"{datetime.datetime.now()}"
-                drawer.draw()
+                drawer.request_draw()
                 callback(self)
             else:
                 print(f"[JOBCTRL] Task started : {self}")
                 self._fillcolor = BLUE
-                drawer.draw()
+                drawer.request_draw()
                 try:
                     self._return_code = await self._do_work()
                     # if self.name.startswith("T11"):
@@ -257,30 +275,69 @@ class Task:
                     self._return_code = 9
                 finally:
                     self._ended_at = time.time()
-                    self._end_dt = f"{datetime.datetime.now()}"
                     if self.ok:
                         self._fillcolor = GREEN
                     elif self.skipped:
                         self._fillcolor = YELLOW
                     elif self.failed:
                         self._fillcolor = RED
-                    drawer.draw()
+                    drawer.request_draw()
                     callback(self)
         try:
-            self._create_result_html_page()
+            self._create_result_html_page(drawer.directory)
         except Exception as ex:
             print("EX:", ex)
             pass
 
     async def _do_work(self):
         """Default action"""
-        os.chdir(self._cwd)
+        import random
         self._command = "asyncio.sleep(random.randint(5, 15))"
         await asyncio.sleep(random.randint(5, 15))
         self._result = "Woke up from sleep"
         return 0
 
+    def cache_key(self) -> str:
+        """A digest of everything that determines the result of the task work."""
+        if self._cache_key is None:
+            digest = hashlib.sha256()
+            digest.update(repr((self._input, os.path.abspath(self._cwd))).encode())
+            for path in sorted(self._input_files):
+                with open(os.path.join(self._cwd, path), "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            for parent in self._parents:
+                digest.update(parent.cache_key().encode())
+            self._cache_key = digest.hexdigest()
+        return self._cache_key
+
+    async def _cached_process(self):
+        if not self._cache:
+            return await self._process()
+        path = os.path.join(CACHE_DIR, f"{self.cache_key()}.json")
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            returncode = await self._process()
+            if returncode == 0:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump(
+                        {
+                            "returncode": returncode,
+                            "stdout": self._stdout,
+                            "stderr": self._stderr,
+                        },
+                        f,
+                    )
+            return returncode
+        print(f"[JOBCTRL] Task cached  : {self}")
+        self._stdout = cached["stdout"]
+        self._stderr = cached["stderr"]
+        return cached["returncode"]
+
     def report(self):
+        import datetime
         collector = []
         collector.append(f"{'=' * 70}")
         collector.append(f"Report from task: {self._name}:")
@@ -290,9 +347,9 @@ class Task:
         collector.append(f"  Status     : {self.status}")
         collector.append(f"  Return Code: {self._return_code}")
         collector.append(f"  Result     : {self._result}")
-        collector.append(f"  Started at : {self._start_dt}")
+        collector.append(f"  Started at : {datetime.datetime.fromtimestamp(self._started_at)}")
         collector.append(f"  Run-time   : {(self._ended_at - self._started_at):.1f}")
-        collector.append(f"  Ended at   : {self._end_dt}")
+        collector.append(f"  Ended at   : {datetime.datetime.fromtimestamp(self._ended_at)}")
         collector.append(f"  Cwd        : {self._cwd}")
         collector.append(f"  Exception  : {self._except}")
         if self._stdout and len(self._stdout.strip()) > 0:
@@ -303,7 +360,7 @@ class Task:
             collector.append(self._stderr)
         return "\n".join(collector)
 
-    def _create_result_html_page(self):
+    def _create_result_html_page(self, directory):
         TEMPLATE = f"""
         <!DOCTYPE html>
         <html>
@@ -317,17 +374,18 @@ class Task:
         </html>
         """
         self._url = f"{self._name}.html"
-        with open(self._url, "w") as f:
+        with open(os.path.join(directory, self._url), "w") as f:
             f.write(TEMPLATE)
 
 
 class SubprocessTask(Task):
     """Run a subprocess task."""
 
+    __slots__ = ()
+
     async def _do_work(self):
-        os.chdir(self._cwd)
         self._command = " ".join(self._input)
-        returncode = await self._process()
+        returncode = await self._cached_process()
         if returncode == 0:
             self._result = "subprocess completed successfully"
         else:
@@ -337,7 +395,8 @@ class SubprocessTask(Task):
 
     async def _process(self):
         process = await asyncio.create_subprocess_exec(
-            *self._input, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            *self._input, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            cwd=self._cwd,
         )
         stdout, stderr = await process.communicate()
         self._stdout = stdout.decode()
@@ -348,10 +407,11 @@ class SubprocessTask(Task):
 class ShellTask(Task):
     """Run a shell task."""
 
+    __slots__ = ()
+
     async def _do_work(self):
         self._command = self._input
-        os.chdir(self._cwd)
-        returncode = await self._process()
+        returncode = await self._cached_process()
         if returncode == 0:
             self._result = "subprocess completed successfully"
         else:
@@ -361,7 +421,8 @@ class ShellTask(Task):
 
     async def _process(self):
         process = await asyncio.create_subprocess_shell(
-            self._input, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            self._input, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            cwd=self._cwd,
         )
         stdout, stderr = await process.communicate()
         self._stdout = stdout.decode()
@@ -376,37 +437,55 @@ class JobController:
 
     def __init__(self):
         self._waiting_tasks = []
+        self._children = {}
+        self._remaining = {}
         self._finished_tasks = []
         self._running_tasks = []
         self._start_tasks = []
 
     def add_tasks(self, tasks):
-        self._waiting_tasks.extend(tasks)
+        for task in tasks:
+            self._waiting_tasks.append(task)
+            self._children.setdefault(task.name, [])
+            self._remaining[task.name] = len(task.wait)
+            for name in task.wait:
+                self._children.setdefault(name, []).append(task)
 
     async def start(self):
-        self._remove_old_html_files()
-        self._workflow_drawer = WorkflowDrawer(self._waiting_tasks)
+        from workflowdrawer import DrawerCoalescer, WorkflowDrawer
+        tasks_by_name = {t.name: t for t in self._waiting_tasks}
+        for t in self._waiting_tasks:
+            t._parents = [tasks_by_name[name] for name in t.wait if name in tasks_by_name]
+        self._workflow_drawer = DrawerCoalescer(WorkflowDrawer(self._waiting_tasks))
+        self._remove_old_html_files(self._workflow_drawer.directory)
         self._workflow_drawer.draw()
         print("[JOBCTRL] Job started  :")
         await asyncio.gather(
             *[
                 t.run(self.task_finished, self._workflow_drawer)
-                for t in self._waiting_tasks
+                for t in self._topological_order()
             ]
         )
         self._workflow_drawer.draw(done=True)
         print("[JOBCTRL] Job finsished:")
 
-    def _remove_old_html_files(self):
-        for file in os.listdir("."):
-            if file.endswith(".html") and file != "sample1.html":
-                os.unlink(os.path.join(".", file))
-
-    def _can_start(self, task):
-        task.wait = list(
-            set(task.wait).difference(set([task.name for task in self._finished_tasks]))
+    def _topological_order(self):
+        """Tasks ordered so that every task comes after the tasks it waits for."""
+        tasks_by_name = {t.name: t for t in self._waiting_tasks}
+        sorter = graphlib.TopologicalSorter(
+            {t.name: t.wait for t in self._waiting_tasks}
         )
-        return len(task.wait) == 0
+        return [
+            tasks_by_name[name]
+            for name in sorter.static_order()
+            if name in tasks_by_name
+        ]
+
+    def _remove_old_html_files(self, directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".html") and entry.name != "sample1.html":
+                    os.unlink(entry.path)
 
     def task_finished(self, task):
         if task.stopped:
@@ -414,20 +493,20 @@ class JobController:
         else:
             self._finished_tasks.append(task)
             print(f"[JOBCTRL] Task finished: {task}")
-            for t in [t for t in self._waiting_tasks if t != task]:
-                if task.name in t._wait_for:
-                    if task.failed and task.name not in t.run_on_fail:
-                        t._wait_for.clear()
-                        t.skip()
-            for t in [t for t in self._waiting_tasks if t != task]:
-                if task.name in t._wait_for:
-                    if task.skipped and task.name not in t.run_on_skip:
-                        t._wait_for.clear()
-                        t.skip()
-            for t in [t for t in self._waiting_tasks if t != task]:
-                if task.name in t._wait_for:
-                    t._wait_for.remove(task.name)
-        self._workflow_drawer.draw()
+            for t in self._children[task.name]:
+                if t._ready.is_set():
+                    continue
+                if (
+                    (task.failed and task.name not in t.run_on_fail) or
+                    (task.skipped and task.name not in t.run_on_skip)
+                ):
+                    t.skip()
+                    t._ready.set()
+                else:
+                    self._remaining[t.name] -= 1
+                    if self._remaining[t.name] == 0:
+                        t._ready.set()
+        self._workflow_drawer.request_draw()
 
 
 async def test():
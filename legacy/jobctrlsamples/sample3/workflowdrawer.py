@@ -1,59 +1,94 @@
+import asyncio
 import os
+import subprocess
 
 REPLACEMENT_TAG = "$NODE-LIST$"
 GREEN = '"#B2FEB2"'
 YELLOW = '"#FDFEB2"'
 RED = '"#F63E3E"'
+DOT_HEADER = "\n".join([
+    "digraph {",
+    f"Start[fillcolor={GREEN},style=filled];",
+    "Stop[fillcolor=white,style=filled];",
+    REPLACEMENT_TAG,
+])
+DOT_FOOTER = "}"
 
 class WorkflowDrawer:
 
     def __init__(self, tasks):
         self._tasks = tasks
-        self._text = self._create_text()
+        self.directory = os.path.dirname(os.path.abspath(__file__))
+        self._prefix, self._suffix = f"//copy\n{self._create_text()}".split(REPLACEMENT_TAG)
         self._img = None
+        self._drawn = None
 
     def _create_text(self):
         """Create a digraph in DOT format."""
-        self._ending_tasks = []
-        collector = ["digraph {"]
-        collector.append(f'Start[fillcolor={GREEN},style=filled];')
-        collector.append('Stop[fillcolor=white,style=filled];')
-        has_dependants = set()
-        collector.append(REPLACEMENT_TAG)
-        for t in self._tasks:
-            if len(t.original_waits) == 0:
-                #    start -> T2;
-                collector.append(f"Start -> {t.name};")
-                has_dependants.add(t.name)
-            else:
-                for d in t.original_waits:
-                    collector.append(f'{d} -> {t.name};')
-                    has_dependants.add(d)
-        for t in self._tasks:
-            if t.name not in has_dependants:
-                collector.append(f"{t.name} -> Stop;")
-                self._ending_tasks.append(t)
-        collector.append("}")
-        return '\n'.join(collector)
+        #    start -> T2;
+        edges = [
+            (d, t.name)
+            for t in self._tasks
+            for d in t.original_waits or ["Start"]
+        ]
+        has_dependants = {t if d == "Start" else d for d, t in edges}
+        self._ending_tasks = [t for t in self._tasks if t.name not in has_dependants]
+        return "\n".join([
+            DOT_HEADER,
+            *(f"{d} -> {t};" for d, t in edges),
+            *(f"{t.name} -> Stop;" for t in self._ending_tasks),
+            DOT_FOOTER,
+        ])
 
     def draw(self, done=False):
         """Create a digraph in DOT format."""
-        abspath = os.path.abspath(__file__)
-        dname = os.path.dirname(abspath)
-        os.chdir(dname)
-        collector = []
-        for t in self._tasks:
-            # T2[label="T2.Remove old build dir"];
-            collector.append(f'{t.name}[label="{t.name}.{t.description}",fillcolor={t.fillcolor},style=filled,URL="{t.url}"];')
-        t = f"//copy\n{self._text}"
-        tt = t.replace(REPLACEMENT_TAG, "\n".join(collector))
+        # T2[label="T2.Remove old build dir"];
+        nodes = "\n".join(
+            f'{t.name}[label="{t.name}.{t.description}",fillcolor={t.fillcolor},style=filled,URL="{t.url}"];'
+            for t in self._tasks
+        )
+        tt = "".join([self._prefix, nodes, self._suffix])
         if done:
-            if len([t for t in self._ending_tasks if t.failed]) > 0:
-                tt = tt.replace("Stop[fillcolor=white,style=filled];", f"Stop[fillcolor={RED},style=filled];")
-            elif len([t for t in self._ending_tasks if t.skipped]) > 0:
-                tt = tt.replace("Stop[fillcolor=white,style=filled];", f"Stop[fillcolor={YELLOW},style=filled];")
+            if any(t.failed for t in self._ending_tasks):
+                color = RED
+            elif any(t.skipped for t in self._ending_tasks):
+                color = YELLOW
             else:
-                tt = tt.replace("Stop[fillcolor=white,style=filled];", f"Stop[fillcolor={GREEN},style=filled];")
-        with open("sample1.txt", "w") as f:
+                color = GREEN
+            tt = tt.replace("Stop[fillcolor=white,style=filled];", f"Stop[fillcolor={color},style=filled];")
+        if tt == self._drawn:
+            return
+        self._drawn = tt
+        dot_path = os.path.join(self.directory, "sample1.txt")
+        with open(dot_path, "w") as f:
             f.write(tt)
-        os.system("dot sample1.txt -Tsvg -osample1.svg")
+        try:
+            subprocess.run(["dot", dot_path, "-Tsvg", "-o", os.path.join(self.directory, "sample1.svg")])
+        except OSError as ex:
+            print("EX:", ex)
+
+
+class DrawerCoalescer:
+    """Coalesce draw requests made close in time into a single draw."""
+
+    def __init__(self, drawer, delay=0.1):
+        self._drawer = drawer
+        self._delay = delay
+        self._pending = None
+        self.directory = drawer.directory
+
+    def request_draw(self):
+        """Draw within the delay, together with any other requests made meanwhile."""
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().call_later(self._delay, self._draw)
+
+    def draw(self, done=False):
+        """Draw immediately, including any pending request."""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        self._drawer.draw(done)
+
+    def _draw(self):
+        self._pending = None
+        self._drawer.draw()
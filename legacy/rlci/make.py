@@ -26,14 +26,23 @@ def target(dependencies=[], alias=False):
 @target()
 def tool_build():
     with cd("tool"):
-        with open("tool.py", "wb") as f:
-            f.write(subprocess.run([
-                sys.executable, "../../rlmeta/rlmeta.py",
-                "--copy", "src/header.py",
-                "--support",
-                "--compile", "src/tool.rlmeta",
-                "--copy", "src/footer.py",
-            ], check=True, stdout=subprocess.PIPE).stdout)
+        if is_up_to_date("tool.py", [
+            "../../rlmeta/rlmeta.py",
+            "src/header.py",
+            "src/tool.rlmeta",
+            "src/footer.py",
+        ]):
+            return
+        tool = subprocess.run([
+            sys.executable, "../../rlmeta/rlmeta.py",
+            "--copy", "src/header.py",
+            "--support",
+            "--compile", "src/tool.rlmeta",
+            "--copy", "src/footer.py",
+        ], check=True, stdout=subprocess.PIPE).stdout
+        with open("tool.py.tmp", "wb") as f:
+            f.write(tool)
+        os.replace("tool.py.tmp", "tool.py")
 
 @target(dependencies=["tool/build"])
 def tool_test():
@@ -139,6 +148,12 @@ def run_processes(process_descriptions):
     except KeyboardInterrupt:
         pass
 
+def is_up_to_date(output, sources):
+    if not os.path.exists(output):
+        return False
+    mtime = os.path.getmtime(output)
+    return all(os.path.getmtime(source) <= mtime for source in sources)
+
 @contextlib.contextmanager
 def cd(path):
     cwd = os.getcwd()
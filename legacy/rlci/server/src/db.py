@@ -68,6 +68,11 @@ class PipelineDB:
             logs["lines"].append(line)
         return await self.store.modify_object(logs_id, modify)
 
+    async def add_logs(self, logs_id, lines):
+        def modify(logs):
+            logs["lines"].extend(lines)
+        return await self.store.modify_object(logs_id, modify)
+
     async def store_logs(self, logs):
         return await self.store.create_object(logs)
 
@@ -1,84 +1,181 @@
 import asyncio
+import collections
 import json
 import sys
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 import db
 import ipc
 
 class StageExecutioner:
 
+    LOG_BATCH_SIZE = 64
+    LOG_BATCH_DELAY = 0.05
+    LOG_LINE_LIMIT = 16 * 1024 * 1024
+
     def __init__(self, db):
         self.db = db
 
-    async def start_process(self, ast, args, logs_id):
+    async def start_process(self, ast_bytes, args, logs_id):
         cmd_args = []
         for key, value in args.items():
             cmd_args.append(f"{key}={value}")
         process = await asyncio.create_subprocess_exec(
             sys.executable, "../../tool/tool.py", "run", *cmd_args,
             stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE
+            stdout=asyncio.subprocess.PIPE,
+            limit=self.LOG_LINE_LIMIT
         )
-        stdout, stderr = await process.communicate(json.dumps(ast).encode("utf-8"))
-        for line in stdout.splitlines():
-            await self.db.add_log(logs_id, json.loads(line))
+        lines = asyncio.Queue(maxsize=16 * self.LOG_BATCH_SIZE)
+        reader = asyncio.create_task(self.read_lines(process.stdout, lines))
+        writer = asyncio.create_task(self.write_ast(process.stdin, ast_bytes))
+        try:
+            done = False
+            while not done:
+                batch = [await lines.get()]
+                deadline = asyncio.get_running_loop().time() + self.LOG_BATCH_DELAY
+                while isinstance(batch[-1], bytes) and len(batch) < self.LOG_BATCH_SIZE:
+                    timeout = deadline - asyncio.get_running_loop().time()
+                    try:
+                        batch.append(await asyncio.wait_for(lines.get(), max(timeout, 0)))
+                    except asyncio.TimeoutError:
+                        break
+                if not isinstance(batch[-1], bytes):
+                    end = batch.pop()
+                    done = True
+                if batch:
+                    await self.db.add_logs(logs_id, json_loads(b"[" + b",".join(batch) + b"]"))
+            if end is not None:
+                raise end
+            await writer
+            await reader
+        except BaseException:
+            writer.cancel()
+            reader.cancel()
+            if process.returncode is None:
+                process.kill()
+            await asyncio.gather(writer, reader, return_exceptions=True)
+            # Reads what is left of stdout so that the pipe closes, which the
+            # process must do before it can be waited for
+            await process.communicate()
+            raise
         await process.wait()
 
+    async def write_ast(self, stdin, ast_bytes):
+        # Like communicate(), a tool that exits without reading all of its
+        # input is not an error here: its output and returncode tell
+        try:
+            stdin.write(ast_bytes)
+            await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        stdin.close()
+
+    async def read_lines(self, stdout, lines):
+        # Lines are followed by None, or by the error that stopped reading, so
+        # that the consumer never waits for lines that will not come
+        try:
+            async for line in stdout:
+                await lines.put(line)
+        except Exception as e:
+            await lines.put(e)
+        else:
+            await lines.put(None)
+
 class JobController:
 
+    PIPELINE_CACHE_SIZE = 128
+
     def __init__(self, db, stage_executioner):
         self.db = db
-        self.tasks = []
+        self.tasks = set()
         self.stage_executioner = stage_executioner
+        self.parsed_pipelines = collections.OrderedDict()
 
     async def trigger(self, values):
         execution_ids = []
         for (pipeline_id, pipeline) in await self.db.get_active_pipelines():
-            for ast in pipeline["definition"]:
-                if ast[0] == "Node":
-                    for trigger in ast[2]["triggers"]:
-                        if self.trigger_matches(trigger, values):
-                            execution_id = await self.db.store_execution(
-                                pipeline_id,
-                                await self.create_execution(pipeline)
-                            )
-                            execution_ids.append(execution_id)
-                            task = asyncio.create_task(self.execute_stage(execution_id, str(ast[1]), values))
-                            self.tasks.append(task)
-                            task.add_done_callback(lambda x: self.tasks.remove(x))
+            parsed = self.parse_pipeline(pipeline_id, pipeline)
+            for stage_id, trigger in parsed["triggers"]:
+                if self.trigger_matches(trigger, values):
+                    execution_id = await self.db.store_execution(
+                        pipeline_id,
+                        await self.create_execution(parsed)
+                    )
+                    execution_ids.append(execution_id)
+                    task = asyncio.create_task(self.execute_stage(
+                        execution_id,
+                        stage_id,
+                        parsed["stages"][stage_id]["ast_bytes"],
+                        values
+                    ))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
         return execution_ids
 
-    def trigger_matches(self, trigger, values):
-        for key, value in trigger.items():
-            if key not in values or values[key] != value:
-                return False
-        return True
-
-    async def create_execution(self, pipeline):
+    def parse_pipeline(self, pipeline_id, pipeline):
+        # A pipeline id refers to a version of a definition that is never modified
+        if pipeline_id in self.parsed_pipelines:
+            self.parsed_pipelines.move_to_end(pipeline_id)
+            return self.parsed_pipelines[pipeline_id]
+        triggers = []
         stages = {}
         for ast in pipeline["definition"]:
             if ast[0] == "Node":
+                for trigger in ast[2]["triggers"]:
+                    triggers.append((str(ast[1]), trigger))
                 stages[str(ast[1])] = {
                     "ast": ast[3],
-                    "status": "waiting",
-                    "input": {},
-                    "output": {},
-                    "logs": await self.db.store_logs({"lines": []}),
+                    "ast_bytes": json.dumps(ast[3], separators=(",", ":")).encode("utf-8"),
                     "children": [],
                     "parents": [],
                 }
             elif ast[0] == "Link":
                 stages[str(ast[1])]["children"].append(str(ast[2]))
                 stages[str(ast[2])]["parents"].append(str(ast[1]))
+        for stage in stages.values():
+            stage["children"] = tuple(stage["children"])
+            stage["parents"] = tuple(stage["parents"])
+        parsed = {
+            "triggers": tuple(triggers),
+            "stages": stages,
+        }
+        self.parsed_pipelines[pipeline_id] = parsed
+        if len(self.parsed_pipelines) > self.PIPELINE_CACHE_SIZE:
+            self.parsed_pipelines.popitem(last=False)
+        return parsed
+
+    def trigger_matches(self, trigger, values):
+        for key, value in trigger.items():
+            if key not in values or values[key] != value:
+                return False
+        return True
+
+    async def create_execution(self, parsed):
+        stages = {}
+        for stage_id, stage in parsed["stages"].items():
+            stages[stage_id] = {
+                "ast": stage["ast"],
+                "status": "waiting",
+                "input": {},
+                "output": {},
+                "logs": await self.db.store_logs({"lines": []}),
+                "children": stage["children"],
+                "parents": stage["parents"],
+            }
         return {
             "status": "running",
             "stages": stages,
         }
 
-    async def execute_stage(self, execution_id, stage_id, args):
+    async def execute_stage(self, execution_id, stage_id, ast_bytes, args):
         execution = await self.db.modify_execution_start(execution_id, stage_id, args)
         await self.stage_executioner.start_process(
-            execution["stages"][stage_id]["ast"],
+            ast_bytes,
             args,
             execution["stages"][stage_id]["logs"]
         )
@@ -115,7 +115,7 @@ class TestJobController(unittest.TestCase):
 
     class MockStageExecutioner:
 
-        async def start_process(self, ast, args, logs_id):
+        async def start_process(self, ast_bytes, args, logs_id):
             pass
 
     def test_trigger_pipeline(self):
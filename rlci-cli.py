@@ -1,3 +1,4 @@
 if __name__ == "__main__":
+    import sys
     from rlci.cli import CLI
-    CLI.create().run()
+    sys.exit(CLI.create().run())
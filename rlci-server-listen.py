@@ -1,6 +1,5 @@
 import os
 import socket
-import subprocess
 import sys
 
 path = sys.argv[1]
@@ -10,10 +9,11 @@ except FileNotFoundError:
     pass
 s = socket.socket(family=socket.AF_UNIX)
 s.bind(path)
-s.listen()
+s.listen(4096)
 
 os.dup2(s.fileno(), 0)
 os.close(s.fileno())
 
 while True:
-    subprocess.call(sys.argv[2:])
+    pid = os.posix_spawnp(sys.argv[2], sys.argv[2:], os.environ)
+    os.waitpid(pid, 0)
@@ -1,5 +1,3 @@
-import sys
-
 from rlci.engine import TRIGGER_RESPONSE_FAIL, TRIGGER_RESPONSE_SUCCESS
 from rlci.events import Events
 from rlci.infrastructure import Args, Terminal, UnixDomainSocketClient
@@ -68,16 +66,23 @@ class CLI:
         self.terminal = terminal
         self.args = args
         self.client = client
+        self.commands = {
+            "trigger": self.trigger_command,
+        }
 
     def run(self):
-        if self.args.get() == ["trigger"]:
-            self.terminal.print_line("Usage: python3 rlci-cli.py trigger <pipeline>")
-            sys.exit(1)
-        elif self.args.get()[:1] == ["trigger"]:
-            self.trigger(self.args.get()[1])
-        else:
+        args = self.args.get()
+        command = self.commands.get(args[0] if args else None)
+        if command is None:
             self.terminal.print_line("Usage: python3 rlci-cli.py trigger")
-            sys.exit(1)
+            return 1
+        return command(args[1:])
+
+    def trigger_command(self, args):
+        if not args:
+            self.terminal.print_line("Usage: python3 rlci-cli.py trigger <pipeline>")
+            return 1
+        return self.trigger(args[0])
 
     def trigger(self, name):
         try:
@@ -89,7 +94,7 @@ class CLI:
             successful = False
         else:
             successful = response == b'True'
-        sys.exit(0 if successful else 1)
+        return 0 if successful else 1
 
     @staticmethod
     def create():
@@ -111,12 +116,9 @@ class CLI:
                 client_responses.append(TRIGGER_RESPONSE_FAIL)
             else:
                 client_responses.append(TRIGGER_RESPONSE_SUCCESS)
-        try:
-            CLI(
-                terminal=events.listen(Terminal.create_null()),
-                args=Args.create_null(args),
-                client=events.listen(UnixDomainSocketClient.create_null(responses=client_responses))
-            ).run()
-        except SystemExit as e:
-            events.append(("EXIT", e.code))
+        events.append(("EXIT", CLI(
+            terminal=events.listen(Terminal.create_null()),
+            args=Args.create_null(args),
+            client=events.listen(UnixDomainSocketClient.create_null(responses=client_responses))
+        ).run()))
         return events
@@ -1,4 +1,8 @@
+import concurrent.futures
+import functools
+import graphlib
 import pprint
+import types
 
 from rlci.events import Events
 from rlci.infrastructure import Terminal, Process, Filesystem, UnixDomainSocketServer
@@ -160,10 +164,14 @@ class Engine:
         self.process = process
         self.db = db
         self.filesystem = filesystem
-        self.db.save_pipeline("rlci", rlci_pipeline())
-        self.db.save_pipeline("test-pipeline", {"name": "TEST-PIPELINE", "steps": []})
+        self.pipeline_factories = {
+            "rlci": rlci_pipeline,
+            "test-pipeline": lambda: {"name": "TEST-PIPELINE", "steps": []},
+        }
 
     def trigger(self, name):
+        if name in self.pipeline_factories and not self.db.has_pipeline(name):
+            self.db.save_pipeline(name, self.pipeline_factories[name]())
         pipeline = self.db.get_pipeline(name)
         self.terminal.print_line(f"Triggered {pipeline['name']}")
         try:
@@ -171,7 +179,7 @@ class Engine:
                 terminal=self.terminal,
                 process=self.process,
                 db=self.db
-            ).run(pipeline)
+            ).run(pipeline, self.db.get_step_graph(name))
             return True
         except CommandFailure:
             self.terminal.print_line(f"FAIL")
@@ -183,10 +191,10 @@ class Engine:
                 report.append(f"<h2><pre>{stage_command['command']}<pre></h2>")
                 report.append(f"<p><b>returncode: {stage_command['returncode']}</b></p>")
                 report.append("<pre>")
-                for line in stage_command["output"]:
-                    report.append(line)
+                report.extend(stage_command["output"])
                 report.append("</pre>")
             self.filesystem.write("/opt/rlci/html/index.html", "\n".join(report))
+            self.terminal.flush()
 
     @staticmethod
     def trigger_in_test_mode(pipeline, simulate_failure=False, process_responses=[]):
@@ -236,8 +244,8 @@ class StageExecution:
     ...     },
     ... ]).filter("PROCESS", "EXCEPTION")
     PROCESS => ['mktemp', '-d']
-    PROCESS => ['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/workspace', './build']
-    PROCESS => ['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/workspace', './deploy']
+    PROCESS => ['sh', '-c', 'cd "$1" && shift && exec "$@"', 'sh', '/workspace', './build']
+    PROCESS => ['sh', '-c', 'cd "$1" && shift && exec "$@"', 'sh', '/workspace', './deploy']
     PROCESS => ['rm', '-rf', '/workspace']
 
     If workspace creations fails, I fail:
@@ -264,7 +272,7 @@ class StageExecution:
     ...     },
     ... ]).filter("PROCESS", "EXCEPTION")
     PROCESS => ['mktemp', '-d']
-    PROCESS => ['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/workspace', './build']
+    PROCESS => ['sh', '-c', 'cd "$1" && shift && exec "$@"', 'sh', '/workspace', './build']
     PROCESS => ['rm', '-rf', '/workspace']
     EXCEPTION => 'CommandFailure'
 
@@ -281,8 +289,8 @@ class StageExecution:
     ... ]).filter("STDOUT")
     STDOUT => "['mktemp', '-d']"
     STDOUT => '/workspace'
-    STDOUT => "['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/workspace', './build']"
-    STDOUT => "['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/workspace', './deploy']"
+    STDOUT => '[\\'sh\\', \\'-c\\', \\'cd "$1" && shift && exec "$@"\\', \\'sh\\', \\'/workspace\\', \\'./build\\']'
+    STDOUT => '[\\'sh\\', \\'-c\\', \\'cd "$1" && shift && exec "$@"\\', \\'sh\\', \\'/workspace\\', \\'./deploy\\']'
     STDOUT => "['rm', '-rf', '/workspace']"
 
     I store logs in the database of the commands I run:
@@ -300,10 +308,10 @@ class StageExecution:
     ... ], return_events=False)
     >>> pprint.pprint(run["db"].get_stage_commands())
     [{'command': ['mktemp', '-d'], 'output': ['/workspace'], 'returncode': 0},
-     {'command': ['python3',
+     {'command': ['sh',
                   '-c',
-                  'import sys; import os; os.chdir(sys.argv[1]); '
-                  'os.execvp(sys.argv[2], sys.argv[2:])',
+                  'cd "$1" && shift && exec "$@"',
+                  'sh',
                   '/workspace',
                   './build'],
       'output': ['I failed :('],
@@ -330,18 +338,81 @@ class StageExecution:
     PROCESS => [..., 'cat', 'path.txt']
     PROCESS => [..., 'cd', 'secret-path']
     PROCESS => [...]
+
+    Step ordering
+    =============
+
+    A step runs after the step before it, unless it names the steps it runs
+    after. Steps that do not depend on each other run concurrently:
+
+    >>> events = StageExecution.run_in_test_mode({
+    ...     "steps": [
+    ...         {"name": "lint", "command": ["./lint"], "after": []},
+    ...         {"name": "test", "command": ["./test"], "after": []},
+    ...         {"command": ["./deploy"], "after": ["lint", "test"]},
+    ...     ]
+    ... }, process_responses=[
+    ...     {
+    ...         "command": Workspace.create_create_command(),
+    ...         "output": ["/workspace"],
+    ...     },
+    ... ]).filter("PROCESS")
+    >>> sorted(command[-1] for event, command in events[1:3])
+    ['./lint', './test']
+    >>> Events(events[3:]) # doctest: +ELLIPSIS
+    PROCESS => [..., './deploy']
+    PROCESS => ['rm', '-rf', '/workspace']
+
+    When a step fails, I start no more steps, but let running ones finish:
+
+    >>> StageExecution.run_in_test_mode({
+    ...     "steps": [
+    ...         {"name": "lint", "command": ["./lint"], "after": []},
+    ...         {"command": ["./deploy"], "after": ["lint"]},
+    ...     ]
+    ... }, process_responses=[
+    ...     {
+    ...         "command": Workspace.create_create_command(),
+    ...         "output": ["/workspace"],
+    ...     },
+    ...     {
+    ...         "command": ProcessInDirectory.create_command(["./lint"], "/workspace"),
+    ...         "returncode": 99,
+    ...     },
+    ... ]).filter("PROCESS", "EXCEPTION") # doctest: +ELLIPSIS
+    PROCESS => ['mktemp', '-d']
+    PROCESS => [..., './lint']
+    PROCESS => ['rm', '-rf', '/workspace']
+    EXCEPTION => 'CommandFailure'
+
+    When there are more ready steps than workers, steps heading the longest
+    chains start first:
+
+    >>> StageExecution.run_in_test_mode({
+    ...     "steps": [
+    ...         {"name": "docs", "command": ["./docs"], "after": []},
+    ...         {"name": "build", "command": ["./build"], "after": []},
+    ...         {"command": ["./deploy"], "after": ["build"]},
+    ...     ]
+    ... }, max_workers=1).filter("PROCESS") # doctest: +ELLIPSIS
+    PROCESS => ['mktemp', '-d']
+    PROCESS => [..., './build']
+    PROCESS => [..., './docs']
+    PROCESS => [..., './deploy']
+    PROCESS => ['rm', '-rf', '']
     """
 
-    def __init__(self, terminal, process, db):
+    def __init__(self, terminal, process, db, max_workers=None):
         self.terminal = terminal
         self.process = process
         self.db = db
+        self.max_workers = max_workers
 
-    def run(self, stage):
+    def run(self, stage, step_graph=None):
         self.db.create_stage_commands()
         with Workspace(PipelineStageProcess(self.terminal, self.process, self.db)) as workspace:
             variables = {}
-            for step in stage["steps"]:
+            def run_step(step):
                 command = [
                     x if isinstance(x, str) else variables[x["variable"]]
                     for x
@@ -351,15 +422,135 @@ class StageExecution:
                     workspace.run(command)
                 else:
                     variables[step["variable"]] = workspace.slurp(command)
+            steps = stage["steps"]
+            if not any("after" in step for step in steps):
+                for step in steps:
+                    run_step(step)
+            else:
+                if step_graph is None:
+                    step_graph = self.step_graph(steps)
+                self.run_concurrently(steps, step_graph, run_step)
+
+    def run_concurrently(self, steps, step_graph, run_step):
+        remaining = {
+            index: len(parents)
+            for index, parents in enumerate(step_graph["parents"])
+        }
+        children = step_graph["children"]
+        # Steps heading the longest chains are submitted first so that they
+        # get workers before shorter chains when not all ready steps fit.
+        levels = step_graph["levels"]
+        def submit_ready(indices):
+            for index in sorted(indices, key=lambda index: -levels[index]):
+                running[executor.submit(run_step, steps[index])] = index
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            running = {}
+            submit_ready(
+                index
+                for index, count in remaining.items()
+                if count == 0
+            )
+            failure = None
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    index = running.pop(future)
+                    if future.exception() is not None:
+                        failure = failure or future.exception()
+                    elif failure is None:
+                        ready = []
+                        for child in children[index]:
+                            remaining[child] -= 1
+                            if remaining[child] == 0:
+                                ready.append(child)
+                        submit_ready(ready)
+            if failure is not None:
+                raise failure
+
+    @staticmethod
+    def step_graph(steps):
+        index_by_name = {
+            step["name"]: index
+            for index, step in enumerate(steps)
+            if "name" in step
+        }
+        parents = []
+        for index, step in enumerate(steps):
+            if "after" in step:
+                for name in step["after"]:
+                    if name not in index_by_name:
+                        raise InvalidPipeline(
+                            f"Step {step.get('name', index)!r} runs after "
+                            f"unknown step {name!r}"
+                        )
+                parents.append(tuple(index_by_name[name] for name in step["after"]))
+            else:
+                parents.append((index-1,) if index > 0 else ())
+        children = [[] for step in steps]
+        for index in range(len(steps)):
+            for parent in parents[index]:
+                children[parent].append(index)
+        try:
+            order = tuple(graphlib.TopologicalSorter(
+                dict(enumerate(parents))
+            ).static_order())
+        except graphlib.CycleError as e:
+            cycle = " -> ".join(
+                repr(steps[index].get("name", index))
+                for index in e.args[1]
+            )
+            raise InvalidPipeline(f"Steps {cycle} run after each other in a cycle")
+        # The level of a step is the length of the longest chain of steps
+        # that starts with it.
+        levels = {}
+        for index in reversed(order):
+            levels[index] = 1 + max(
+                (levels[child] for child in children[index]),
+                default=0
+            )
+        return {
+            "parents": tuple(parents),
+            "children": tuple(tuple(x) for x in children),
+            "order": order,
+            "levels": levels,
+        }
 
     @staticmethod
-    def run_in_test_mode(stage, process_responses=[], return_events=True):
+    def check_variables(steps, step_graph):
+        # A step may only use variables set by steps that it runs after,
+        # directly or indirectly. Otherwise whether a variable is set when the
+        # step runs depends on timing.
+        available = {}
+        for index in step_graph["order"]:
+            available[index] = set()
+            for parent in step_graph["parents"][index]:
+                available[index] |= available[parent]
+                if steps[parent].get("variable") is not None:
+                    available[index].add(steps[parent]["variable"])
+            for x in steps[index]["command"]:
+                if not isinstance(x, str) and x["variable"] not in available[index]:
+                    raise InvalidPipeline(
+                        f"Step {steps[index].get('name', index)!r} uses "
+                        f"variable {x['variable']!r} that no step it runs "
+                        f"after sets"
+                    )
+
+    @staticmethod
+    def run_in_test_mode(stage, process_responses=[], return_events=True, max_workers=None):
         events = Events()
         terminal = events.listen(Terminal.create_null())
         process = events.listen(Process.create_null(responses=process_responses))
         db = DB.create_in_memory()
         try:
-            StageExecution(terminal=terminal, process=process, db=db).run(stage)
+            StageExecution(
+                terminal=terminal,
+                process=process,
+                db=db,
+                max_workers=max_workers
+            ).run(stage)
         except CommandFailure:
             events.append(("EXCEPTION", "CommandFailure"))
         if return_events:
@@ -369,15 +560,61 @@ class StageExecution:
 
 class DB:
 
+    """
+    I store pipelines and the commands they run.
+
+    I refuse to save a pipeline whose steps can never all run:
+
+    >>> DB().save_pipeline("cycle", {"name": "CYCLE", "steps": [
+    ...     {"name": "a", "command": ["./a"], "after": ["b"]},
+    ...     {"name": "b", "command": ["./b"], "after": ["a"]},
+    ... ]})
+    Traceback (most recent call last):
+      ...
+    rlci.engine.InvalidPipeline: Steps 'a' -> 'b' -> 'a' run after each other in a cycle
+
+    I refuse to save a pipeline where a step uses a variable that might not
+    be set when it runs:
+
+    >>> DB().save_pipeline("race", {"name": "RACE", "steps": [
+    ...     {"name": "version", "command": ["./version"], "variable": "version", "after": []},
+    ...     {"name": "deploy", "command": ["./deploy", {"variable": "version"}], "after": []},
+    ... ]})
+    Traceback (most recent call last):
+      ...
+    rlci.engine.InvalidPipeline: Step 'deploy' uses variable 'version' that no step it runs after sets
+
+    I refuse to save a pipeline where a step runs after a step that does not
+    exist:
+
+    >>> DB().save_pipeline("typo", {"name": "TYPO", "steps": [
+    ...     {"name": "lint", "command": ["./lint"], "after": []},
+    ...     {"name": "deploy", "command": ["./deploy"], "after": ["lnt"]},
+    ... ]})
+    Traceback (most recent call last):
+      ...
+    rlci.engine.InvalidPipeline: Step 'deploy' runs after unknown step 'lnt'
+    """
+
     def __init__(self):
         self.pipelines = {}
+        self.step_graphs = {}
 
     def save_pipeline(self, name, pipeline):
+        step_graph = StageExecution.step_graph(pipeline["steps"])
+        StageExecution.check_variables(pipeline["steps"], step_graph)
         self.pipelines[name] = pipeline
+        self.step_graphs[name] = step_graph
+
+    def has_pipeline(self, name):
+        return name in self.pipelines
 
     def get_pipeline(self, name):
         return self.pipelines[name]
 
+    def get_step_graph(self, name):
+        return self.step_graphs[name]
+
     def create_stage_commands(self):
         self.stage_commands = []
 
@@ -385,13 +622,15 @@ class DB:
         return self.stage_commands
 
     def add_stage_command(self, command):
-        self.stage_commands.append({"returncode": None, "output": [], "command": command})
+        stage_command = {"returncode": None, "output": [], "command": command}
+        self.stage_commands.append(stage_command)
+        return stage_command
 
-    def set_stage_command_returncode(self, returncode):
-        self.stage_commands[-1]["returncode"] = returncode
+    def set_stage_command_returncode(self, stage_command, returncode):
+        stage_command["returncode"] = returncode
 
-    def add_stage_command_output(self, line):
-        self.stage_commands[-1]["output"].append(line)
+    def add_stage_command_output(self, stage_command, line):
+        stage_command["output"].append(line)
 
     @staticmethod
     def create():
@@ -433,7 +672,7 @@ class ProcessInDirectory(SlurpMixin):
     >>> process = events.listen(Process.create_null())
     >>> ProcessInDirectory(process, "/tmp/foo").run(["ls"])
     >>> events
-    PROCESS => ['python3', '-c', 'import sys; import os; os.chdir(sys.argv[1]); os.execvp(sys.argv[2], sys.argv[2:])', '/tmp/foo', 'ls']
+    PROCESS => ['sh', '-c', 'cd "$1" && shift && exec "$@"', 'sh', '/tmp/foo', 'ls']
     """
 
     def __init__(self, process, directory):
@@ -446,14 +685,10 @@ class ProcessInDirectory(SlurpMixin):
     @staticmethod
     def create_command(command, directory):
         return [
-            "python3",
+            "sh",
             "-c",
-            "; ".join([
-                "import sys",
-                "import os",
-                "os.chdir(sys.argv[1])",
-                "os.execvp(sys.argv[2], sys.argv[2:])",
-            ]),
+            'cd "$1" && shift && exec "$@"',
+            "sh",
             directory
         ] + command
 
@@ -467,20 +702,34 @@ class PipelineStageProcess(SlurpMixin):
     def run(self, command, output=lambda x: None):
         def log(line):
             self.terminal.print_line(line)
-            self.db.add_stage_command_output(line)
+            self.db.add_stage_command_output(stage_command, line)
             output(line)
         self.terminal.print_line(repr(command))
-        self.db.add_stage_command(command)
+        stage_command = self.db.add_stage_command(command)
         returncode = self.process.run(command, output=log)
-        self.db.set_stage_command_returncode(returncode)
+        self.terminal.flush()
+        self.db.set_stage_command_returncode(stage_command, returncode)
         if returncode != 0:
             raise CommandFailure()
 
 class CommandFailure(Exception):
     pass
 
+class InvalidPipeline(Exception):
+    pass
+
+@functools.lru_cache(maxsize=1)
 def rlci_pipeline():
     """
+    I am the same frozen pipeline every time I am called:
+
+    >>> rlci_pipeline() is rlci_pipeline()
+    True
+    >>> rlci_pipeline()["steps"][0]["command"] = []
+    Traceback (most recent call last):
+      ...
+    TypeError: 'mappingproxy' object does not support item assignment
+
     >>> Engine.trigger_in_test_mode(
     ...     rlci_pipeline(),
     ...     process_responses=[
@@ -503,7 +752,7 @@ def rlci_pipeline():
     PROCESS => [..., './zero.py', 'deploy', '<git-commit>']
     PROCESS => ['rm', '-rf', '/workspace']
     """
-    return {
+    return freeze({
         "name": "RLCIPipeline",
         "steps": [
             {"command": ["git", "clone", "git@github.com:rickardlindberg/rlci.git", "."]},
@@ -513,4 +762,14 @@ def rlci_pipeline():
             {"command": ["git", "rev-parse", "HEAD"], "variable": "version"},
             {"command": ["./zero.py", "deploy", {"variable": "version"}]},
         ],
-    }
+    })
+
+def freeze(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({
+            key: freeze(item) for key, item in value.items()
+        })
+    elif isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    else:
+        return value
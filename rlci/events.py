@@ -1,17 +1,85 @@
+import heapq
+
+def ignore_event(event, data):
+    pass
+
 class Observable:
 
     def __init__(self):
-        self.event_listeners = []
+        self.event_listener_notifies = []
+        self.notify = ignore_event
 
     def register_event_listener(self, event_listener):
-        self.event_listeners.append(event_listener)
+        self.event_listener_notifies.append(event_listener.notify)
+        self.notify = self.notify_event_listeners
 
-    def notify(self, event, data):
-        for event_listener in self.event_listeners:
-            event_listener.notify(event, data)
+    def notify_event_listeners(self, event, data):
+        for notify in self.event_listener_notifies:
+            notify(event, data)
+
+def invalidates_positions(method):
+    def invalidate_positions(self, *args):
+        self.positions = None
+        return method(self, *args)
+    return invalidate_positions
 
 class Events(list):
 
+    """
+    I keep an index of where each event is so that I can filter quickly:
+
+    >>> events = Events([("A", 1), ("B", 2), ("A", 3)])
+    >>> events.filter("A")
+    A => 1
+    A => 3
+
+    I rebuild the index when the list is changed in other ways than by
+    appending to it:
+
+    >>> events.insert(0, ("B", 0))
+    >>> events += [("A", 4)]
+    >>> del events[1]
+    >>> events.filter("A")
+    A => 3
+    A => 4
+    >>> events.has("B", 0)
+    True
+    """
+
+    def __init__(self, events=()):
+        list.__init__(self, events)
+        self.positions = None
+
+    def append(self, event):
+        if self.positions is not None:
+            self.positions.setdefault(event[0], []).append(len(self))
+        list.append(self, event)
+
+    def extend(self, events):
+        start = len(self)
+        list.extend(self, events)
+        if self.positions is not None:
+            for position in range(start, len(self)):
+                self.positions.setdefault(self[position][0], []).append(position)
+
+    __iadd__ = invalidates_positions(list.__iadd__)
+    __imul__ = invalidates_positions(list.__imul__)
+    __setitem__ = invalidates_positions(list.__setitem__)
+    __delitem__ = invalidates_positions(list.__delitem__)
+    insert = invalidates_positions(list.insert)
+    pop = invalidates_positions(list.pop)
+    remove = invalidates_positions(list.remove)
+    clear = invalidates_positions(list.clear)
+    sort = invalidates_positions(list.sort)
+    reverse = invalidates_positions(list.reverse)
+
+    def get_positions(self):
+        if self.positions is None:
+            self.positions = {}
+            for position, (event, data) in enumerate(self):
+                self.positions.setdefault(event, []).append(position)
+        return self.positions
+
     @staticmethod
     def capture_from(*observalbes):
         events = Events()
@@ -27,18 +95,27 @@ class Events(list):
         self.append((event, data))
 
     def filter(self, *events):
-        return Events(x for x in self if x[0] in events)
+        return Events(
+            self[position]
+            for position in heapq.merge(*(
+                self.get_positions().get(event, [])
+                for event in set(events)
+            ))
+        )
 
     def has(self, event, data):
-        return (event, data) in self
+        return any(
+            self[position][1] == data
+            for position in self.get_positions().get(event, [])
+        )
 
     def __repr__(self):
-        def data_repr(data):
-            if isinstance(data, dict):
-                return "".join(
-                    f"\n    {key}: {repr(data[key])}"
-                    for key in sorted(data.keys())
-                )
-            else:
-                return f" {repr(data)}"
-        return "\n".join(f"{event} =>{data_repr(data)}" for event, data in self)
+        return "\n".join([
+            "%s =>%s" % (event, "".join([
+                "\n    %s: %r" % item
+                for item in sorted(data.items())
+            ]))
+            if isinstance(data, dict) else
+            "%s => %r" % (event, data)
+            for event, data in self
+        ])
@@ -1,4 +1,6 @@
+import collections
 import os
+import shutil
 import socket
 import subprocess
 import sys
@@ -67,6 +69,13 @@ class Process(Observable):
     2
     >>> output
     ['fake_two']
+
+    I fail with the name of a command that can not be found:
+
+    >>> Process.create().run(["rlci-no-such-command"])
+    Traceback (most recent call last):
+      ...
+    FileNotFoundError: [Errno 2] No such file or directory: 'rlci-no-such-command'
     """
 
     def __init__(self, subprocess):
@@ -88,30 +97,57 @@ class Process(Observable):
 
     @staticmethod
     def create():
-        return Process(subprocess=subprocess)
+        return Process(subprocess=SpawnSubprocess())
 
     @staticmethod
     def create_null(responses=[]):
-        class NullSubprocess:
-            PIPE = None
-            STDOUT = None
-            def Popen(self, command, stdout, stderr, text):
-                response = {"returncode": 0, "output": []}
-                for i in range(len(responses)):
-                    if responses[i]["command"] == command:
-                        response = dict(response, **responses.pop(i))
-                        break
-                return NullProcess(
-                    returncode=response["returncode"],
-                    output=response["output"],
-                )
-        class NullProcess:
-            def __init__(self, returncode, output):
-                self.returncode = returncode
-                self.stdout = output
-            def wait(self):
-                pass
-        return Process(subprocess=NullSubprocess())
+        return Process(subprocess=NullSubprocess(responses))
+
+class SpawnSubprocess:
+
+    PIPE = subprocess.PIPE
+    STDOUT = subprocess.STDOUT
+
+    def Popen(self, command, stdout, stderr, text):
+        # An executable with a directory and close_fds=False lets subprocess
+        # use posix_spawn instead of fork+exec. If the command is not found on
+        # PATH, Popen is left to report why it can not be run.
+        return subprocess.Popen(
+            command,
+            executable=shutil.which(command[0]),
+            close_fds=False,
+            stdout=stdout,
+            stderr=stderr,
+            text=text
+        )
+
+class NullSubprocess:
+
+    PIPE = None
+    STDOUT = None
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def Popen(self, command, stdout, stderr, text):
+        response = {"returncode": 0, "output": []}
+        for i in range(len(self.responses)):
+            if self.responses[i]["command"] == command:
+                response = dict(response, **self.responses.pop(i))
+                break
+        return NullProcess(
+            returncode=response["returncode"],
+            output=response["output"],
+        )
+
+class NullProcess:
+
+    def __init__(self, returncode, output):
+        self.returncode = returncode
+        self.stdout = output
+
+    def wait(self):
+        pass
 
 class Terminal(Observable):
 
@@ -143,17 +179,77 @@ class Terminal(Observable):
     >>> terminal.print_line("hello")
     >>> events
     STDOUT => 'hello'
+
+    I flush after every line only when stdout is a terminal. Otherwise lines
+    are buffered and flushed at most every FLUSH_INTERVAL seconds (or when I
+    am flushed):
+
+    >>> class Stream:
+    ...     def __init__(self, tty):
+    ...         self.tty = tty
+    ...     def isatty(self):
+    ...         return self.tty
+    ...     def write(self, text):
+    ...         print(f"write {text!r}")
+    ...     def flush(self):
+    ...         print("flush")
+    >>> Terminal(Stream(tty=True)).print_line("hello")
+    write 'hello\\n'
+    flush
+    >>> now = 0
+    >>> terminal = Terminal(Stream(tty=False), clock=lambda: now)
+    >>> terminal.print_line("hello")
+    write 'hello\\n'
+    >>> now = Terminal.FLUSH_INTERVAL
+    >>> terminal.print_line("world")
+    write 'world\\n'
+    flush
+    >>> terminal.print_line("!")
+    write '!\\n'
+    >>> terminal.flush()
+    flush
+
+    I print many lines with a single write:
+
+    >>> terminal = Terminal(Stream(tty=True))
+    >>> events = Events.capture_from(terminal)
+    >>> terminal.print_lines(["one", "two"])
+    write 'one\\ntwo\\n'
+    flush
+    >>> events
+    STDOUT => 'one'
+    STDOUT => 'two'
     """
 
-    def __init__(self, stdout):
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, stdout, clock=time.monotonic):
         Observable.__init__(self)
         self.stdout = stdout
+        self.clock = clock
+        self.line_buffered = stdout.isatty()
+        self.last_flush = clock()
 
     def print_line(self, text):
         self.notify("STDOUT", text)
-        self.stdout.write(text)
-        self.stdout.write("\n")
+        self.stdout.write(f"{text}\n")
+        self.flush_if_due()
+
+    def print_lines(self, lines):
+        for text in lines:
+            self.notify("STDOUT", text)
+        self.stdout.write("".join(f"{text}\n" for text in lines))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.line_buffered:
+            self.stdout.flush()
+        elif self.clock() - self.last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
         self.stdout.flush()
+        self.last_flush = self.clock()
 
     @staticmethod
     def create():
@@ -161,12 +257,22 @@ class Terminal(Observable):
 
     @staticmethod
     def create_null():
-        class NullStream:
-            def write(self, text):
-                pass
-            def flush(self):
-                pass
-        return Terminal(NullStream())
+        return Terminal(NULL_STREAM)
+
+class NullStream:
+
+    __slots__ = ()
+
+    def isatty(self):
+        return False
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+NULL_STREAM = NullStream()
 
 class Args:
 
@@ -198,9 +304,12 @@ class Args:
 
     def __init__(self, sys):
         self.sys = sys
+        self.args = None
 
     def get(self):
-        return self.sys.argv[1:]
+        if self.args is None:
+            self.args = self.sys.argv[1:]
+        return self.args
 
     @staticmethod
     def create():
@@ -208,17 +317,73 @@ class Args:
 
     @staticmethod
     def create_null(args):
-        class NullSys:
-            argv = [None]+args
-        return Args(NullSys())
+        return Args(NullSys(args))
+
+class NullSys:
+
+    def __init__(self, args):
+        self.argv = [None]+args
 
 class SocketSerializer:
 
+    """
+    I send objects over a stream socket with a 4 byte length prefix so that
+    objects of any size can be read back whole:
+
+    >>> stream = NullSocketStream(SocketSerializer.frame(b"x"*5000))
+    >>> len(SocketSerializer().read_object(stream))
+    5000
+
+    I return None if the socket is closed before an object starts:
+
+    >>> print(SocketSerializer().read_object(NullSocketStream(b"")))
+    None
+
+    But a socket closed in the middle of an object is an error:
+
+    >>> stream = NullSocketStream(SocketSerializer.frame(b"hello")[:-1])
+    >>> SocketSerializer().read_object(stream)
+    Traceback (most recent call last):
+      ...
+    EOFError: socket closed in the middle of an object
+    """
+
     def write_object(self, socket, obj):
-        return socket.sendall(obj)
+        return socket.sendall(self.frame(obj))
 
     def read_object(self, socket):
-        return socket.recv(1024)
+        header = self.read_exactly(socket, 4, allow_clean_close=True)
+        if header is None:
+            return None
+        return self.read_exactly(socket, int.from_bytes(header, "big"))
+
+    def read_exactly(self, socket, size, allow_clean_close=False):
+        data = bytearray(size)
+        view = memoryview(data)
+        position = 0
+        while position < size:
+            count = socket.recv_into(view[position:])
+            if count == 0:
+                if position == 0 and allow_clean_close:
+                    return None
+                raise EOFError("socket closed in the middle of an object")
+            position += count
+        return bytes(data)
+
+    @staticmethod
+    def frame(obj):
+        return len(obj).to_bytes(4, "big") + obj
+
+class NullSocketStream:
+
+    def __init__(self, data=b""):
+        self.data = data
+
+    def recv_into(self, buffer):
+        count = min(len(buffer), len(self.data))
+        buffer[:count] = self.data[:count]
+        self.data = self.data[count:]
+        return count
 
 class UnixDomainSocketServer(Observable, SocketSerializer):
 
@@ -251,8 +416,11 @@ class UnixDomainSocketServer(Observable, SocketSerializer):
 
     The null version of me simulates a request coming in:
 
+    >>> def handler(request):
+    ...     print(request)
+    ...     return b""
     >>> server = UnixDomainSocketServer.create_null(simulate_request=b"hello")
-    >>> server.register_handler(print)
+    >>> server.register_handler(handler)
     >>> server.start()
     b'hello'
 
@@ -264,6 +432,33 @@ class UnixDomainSocketServer(Observable, SocketSerializer):
     >>> server.start()
     >>> events
     SERVER_RESPONSE => b'hellohello'
+
+    I serve requests on a connection until the client closes it:
+
+    >>> tmp_socket = os.path.join(tmp_dir.name, "loop.socket")
+    >>> server_process = subprocess.Popen([
+    ...     "python", "rlci-server-listen.py",
+    ...     tmp_socket,
+    ...     "python", "-c",
+    ...     "from rlci.infrastructure import UnixDomainSocketServer;"
+    ...     "handler = lambda x: x;"
+    ...     "server = UnixDomainSocketServer.create();"
+    ...     "server.register_handler(handler);"
+    ...     "server.start();"
+    ... ])
+    >>> try:
+    ...     UnixDomainSocketClient.create().send_request(tmp_socket, b"ready")
+    ...     connection = socket.socket(socket.AF_UNIX)
+    ...     connection.connect(tmp_socket)
+    ...     for request in [b"one", b"two"]:
+    ...         SocketSerializer().write_object(connection, request)
+    ...         SocketSerializer().read_object(connection)
+    ...     connection.close()
+    ... finally:
+    ...     server_process.kill()
+    b'ready'
+    b'one'
+    b'two'
     """
 
     def __init__(self, os, socket):
@@ -277,10 +472,13 @@ class UnixDomainSocketServer(Observable, SocketSerializer):
     def start(self):
         s = self.socket.socket(fileno=0)
         connection, address = s.accept()
-        request = self.read_object(connection)
-        response = self.handler(request)
-        self.notify("SERVER_RESPONSE", response)
-        self.write_object(connection, response)
+        while True:
+            request = self.read_object(connection)
+            if request is None:
+                break
+            response = self.handler(request)
+            self.notify("SERVER_RESPONSE", response)
+            self.write_object(connection, response)
 
     @staticmethod
     def create():
@@ -301,9 +499,12 @@ class UnixDomainSocketServer(Observable, SocketSerializer):
                 pass
             def accept(self):
                 return (NullConnection(), None)
-        class NullConnection:
-            def recv(self, bufsize):
-                return simulate_request
+        class NullConnection(NullSocketStream):
+            def __init__(self):
+                NullSocketStream.__init__(
+                    self,
+                    SocketSerializer.frame(simulate_request)
+                )
             def sendall(self, bytes):
                 pass
         return UnixDomainSocketServer(os=NullOs(), socket=NullSocketModule())
@@ -375,28 +576,35 @@ class UnixDomainSocketClient(Observable, SocketSerializer):
                     time.sleep(retry_delays.pop(0))
                 else:
                     raise
-        self.notify("SERVER_REQUEST", (path, request))
-        self.write_object(s, request)
-        return self.read_object(s)
+        try:
+            self.notify("SERVER_REQUEST", (path, request))
+            self.write_object(s, request)
+            response = self.read_object(s)
+            if response is None:
+                raise EOFError("socket closed before a response was sent")
+            return response
+        finally:
+            s.close()
 
     @staticmethod
     def create_null(responses=[]):
+        responses = collections.deque(responses)
         class NullSocketModule:
             AF_UNIX = object()
             def socket(self, family):
                 return NullSocket()
-        class NullSocket:
+        class NullSocket(NullSocketStream):
             def connect(self, path):
                 pass
-            def sendall(self, data):
+            def close(self):
                 pass
-            def recv(self, bufsize):
+            def sendall(self, data):
                 if responses:
                     if isinstance(responses[0], Exception):
-                        raise responses.pop(0)
-                    return responses.pop(0)
+                        raise responses.popleft()
+                    self.data = SocketSerializer.frame(responses.popleft())
                 else:
-                    return b''
+                    self.data = SocketSerializer.frame(b'')
         return UnixDomainSocketClient(socket=NullSocketModule())
 
     @staticmethod
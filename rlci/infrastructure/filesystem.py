@@ -50,14 +50,7 @@ class Filesystem(Observable):
 
     @staticmethod
     def create_null():
-        class NullFile:
-            def write(self, data):
-                pass
-        class NullBuiltins:
-            @contextlib.contextmanager
-            def open(self, path, mode):
-                yield NullFile()
-        return Filesystem(builtins=NullBuiltins())
+        return Filesystem(builtins=NULL_BUILTINS)
 
     def __init__(self, builtins):
         Observable.__init__(self)
@@ -67,3 +60,22 @@ class Filesystem(Observable):
         with self.builtins.open(path, "w") as f:
             f.write(contents)
         self.notify("WRITE_FILE", {"path": path, "contents": contents})
+
+class NullFile:
+
+    __slots__ = ()
+
+    def write(self, data):
+        pass
+
+class NullBuiltins:
+
+    __slots__ = ()
+
+    @contextlib.contextmanager
+    def open(self, path, mode):
+        yield NULL_FILE
+
+NULL_FILE = NullFile()
+
+NULL_BUILTINS = NullBuiltins()
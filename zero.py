@@ -38,6 +38,7 @@ class ZeroApp:
     DOCTEST_MODULE => 'zero'
     DOCTEST_MODULE => 'rlci.cli'
     DOCTEST_MODULE => 'rlci.engine'
+    DOCTEST_MODULE => 'rlci.events'
     DOCTEST_MODULE => 'rlci.infrastructure'
     DOCTEST_MODULE => 'rlci.infrastructure.filesystem'
     TEST_RUN => None
@@ -153,6 +154,7 @@ class ZeroApp:
             self.tests.add_doctest("zero")
             self.tests.add_doctest("rlci.cli")
             self.tests.add_doctest("rlci.engine")
+            self.tests.add_doctest("rlci.events")
             self.tests.add_doctest("rlci.infrastructure")
             self.tests.add_doctest("rlci.infrastructure.filesystem")
             successful, count = self.tests.run()
@@ -174,11 +176,13 @@ class ZeroApp:
                 sys.exit(1)
             self.deploy(self.args.get()[1])
         else:
-            self.terminal.print_line("I am a tool for zero friction development of RLCI.")
-            self.terminal.print_line("")
-            self.terminal.print_line("    ./zero.py build")
-            self.terminal.print_line("    ./zero.py integrate")
-            self.terminal.print_line("    ./zero.py deploy <version>")
+            self.terminal.print_lines([
+                "I am a tool for zero friction development of RLCI.",
+                "",
+                "    ./zero.py build",
+                "    ./zero.py integrate",
+                "    ./zero.py deploy <version>",
+            ])
             sys.exit(1)
 
     def deploy(self, version):